@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+"""
+
+        Heating Demand Analytics
+        ========================
+
+        Keeps a history of the reported temperatures and works out how the day
+        profiles translate into heating demand, a day at a time:
+
+            degree_hours        sum over time of how far the target is above the outside
+                                temperature (the reported one, or outside_baseline if none)
+
+            hours_below_target  time the actual temperature spent more than TOLERANCE under target
+
+            lag                 after each step, ie. each time a rising target moves STEP_SIZE or more
+                                above the actual temperature, how long until actual catches up
+                                to within TOLERANCE (steps not answered within MAX_LAG are left out)
+
+
+        usage:
+                import analytics
+
+                analytics.recordReading(19.5,outside=8.0)   # Stores a reading stamped with the time now
+
+                analytics.dailyMetrics(first,last,compiled,zonename,outside_baseline)
+                                                            # Per local day results from first to last (dates, inclusive)
+
+        The readings for the days needed are loaded into NumPy arrays once. Target temperatures come
+        from interpolating the compiled day profiles over all of them together, and every day's
+        results are then summed with np.bincount, so the work is a handful of array passes whatever
+        the range.
+
+        Readings from LOOKAROUND either side of the days are loaded too, so a day's results never depend
+        on the range it was asked for with. Results for days that are over, including that lookaround,
+        are kept in memcache against a hash of the profiles they used (their own weekday's and, for the
+        lookaround, the weekdays either side), so repeated loads only compute the latest days, or days
+        whose profiles have since changed. Ranges are limited to MAX_DAYS.
+
+"""
+
+import logging,json,hashlib
+from datetime import datetime,timedelta
+
+import numpy as np
+from google.appengine.ext import ndb
+from google.appengine.api import memcache
+
+from tztable import TzTable,EPOCH,toEpoch
+
+TOLERANCE=0.5 # Degrees under target still counted as warm enough
+
+STEP_SIZE=1.0 # Degrees the target must jump above actual to count as a step
+
+MAX_GAP=3600 # Seconds a reading is assumed to hold for when the next one is late or missing
+
+MAX_LAG=6*3600 # Seconds after a step that actual must catch up within to count
+
+LOOKAROUND=max(MAX_GAP,MAX_LAG) # Seconds of readings loaded either side of the days wanted
+
+MAX_DAYS=366 # Longest range dailyMetrics will work on
+
+MEMCACHE_PREFIX="analytics:"
+
+
+class TempReading(ndb.Model):
+    """
+        A single reported temperature
+    """
+    timestamp=ndb.DateTimeProperty(auto_now_add=True)# UTC
+    actual=ndb.FloatProperty()
+    outside=ndb.FloatProperty()# Only if the thermostat reported one
+
+
+def recordReading(actual,outside=None):
+    reading=TempReading()
+    reading.actual=actual
+    reading.outside=outside
+    reading.put()
+
+
+_tables={} # zonename: TzTable, widened as needed
+
+def tableFor(zonename,firstyear,lastyear):
+    """The instance's timezone table for zonename, covering at least firstyear to the year after lastyear"""
+    if zonename not in _tables:
+        _tables[zonename]=TzTable(zonename,years=lastyear-firstyear+2,startyear=firstyear)
+    else:
+        _tables[zonename].extend(firstyear,lastyear+1)
+    return _tables[zonename]
+
+
+def localMidnight(day,table):
+    """Epoch seconds (UTC) of the start of the local date day"""
+    local=toEpoch(datetime(day.year,day.month,day.day))
+    # Treating local time as UTC gives an offset to start from, then the offset at that guess is checked
+    guess=local-table.offsetAt(EPOCH+timedelta(seconds=local))
+    offset=table.offsetAt(EPOCH+timedelta(seconds=guess))
+    midnight=local-offset
+    if table.offsetAt(EPOCH+timedelta(seconds=midnight))==offset:
+        return midnight
+    # Clocks went forward over midnight, so the day starts at the change
+    return max(guess,midnight)
+
+
+def profileKeys(compiled):
+    """
+        A hash for each weekday of the compiled profiles its results depend on,
+        its own and, through the lookaround, the days either side
+    """
+    keys=[]
+    for weekday in range(7):
+        used=[compiled[(weekday+shift)%7] for shift in (-1,0,1)]
+        keys.append(hashlib.md5(json.dumps(used).encode("utf-8")).hexdigest())
+    return keys
+
+
+def loadReadings(start,end):
+    """
+        Returns arrays of epoch seconds, actual and outside temperatures (nan where
+        not reported) for readings between the epoch seconds start and end
+    """
+    qry=TempReading.query(TempReading.timestamp>=EPOCH+timedelta(seconds=start),
+                          TempReading.timestamp<EPOCH+timedelta(seconds=end)).order(TempReading.timestamp)
+    times=[]
+    actuals=[]
+    outsides=[]
+    for reading in qry.iter(batch_size=1000):
+        times.append(toEpoch(reading.timestamp))
+        actuals.append(reading.actual)
+        outsides.append(np.nan if reading.outside==None else reading.outside)
+    logging.info("Loaded %s readings for analytics" % len(times))
+    return np.array(times,dtype=np.int64),np.array(actuals,dtype=float),np.array(outsides,dtype=float)
+
+
+def targetSeries(compiled,table,times):
+    """
+        Returns the local day numbers and target temperatures for an array of epoch seconds,
+        interpolating the compiled day profiles (see TempProfiles.compile) in bulk
+    """
+    starts,offsets=table.transitions()
+    index=np.maximum(np.searchsorted(starts,times,side="right")-1,0)
+    local=times+np.array(offsets)[index]
+    daynums=local//86400
+    hours=(local%86400)/3600.0
+    weekdays=(daynums+3)%7 # 1st Jan 1970 was a Thursday
+    target=np.empty(len(times))
+    for weekday,(profiletimes,profiletemps) in enumerate(compiled):
+        mask=weekdays==weekday
+        target[mask]=np.interp(hours[mask],profiletimes,profiletemps)
+    return daynums,target
+
+
+def computeDays(times,actual,outside,target,daynums,outside_baseline):
+    """
+        Returns a dict of per day metric arrays, one entry per distinct local day number
+    """
+    days,dayindex=np.unique(daynums,return_inverse=True)
+    count=len(days)
+
+    # Each reading holds until the next one, up to MAX_GAP
+    held=np.zeros(len(times))
+    held[:-1]=np.minimum(np.diff(times),MAX_GAP)/3600.0
+
+    outside=np.where(np.isnan(outside),outside_baseline,outside)
+    demand=np.maximum(target-outside,0)*held
+    below=(actual<target-TOLERANCE)*held
+
+    # Steps open where a rising target takes the gap to STEP_SIZE, and close at the next reading within TOLERANCE
+    gap=target-actual
+    opened=np.flatnonzero((gap[1:]>=STEP_SIZE)&(gap[:-1]<STEP_SIZE)&(target[1:]>target[:-1]))+1
+    closed=np.flatnonzero(gap<=TOLERANCE)
+    following=np.searchsorted(closed,opened)
+    # Openings before the previous step has closed share its closing reading, so only the first counts
+    first=np.ones(len(opened),dtype=bool)
+    first[1:]=following[1:]!=following[:-1]
+    opened,following=opened[first],following[first]
+    answered=following<len(closed)
+    opened,following=opened[answered],following[answered]
+    lags=times[closed[following]]-times[opened]
+    inlag=lags<=MAX_LAG
+    opened,lags=opened[inlag],lags[inlag]/60.0
+
+    return {
+        "days":days,
+        "readings":np.bincount(dayindex,minlength=count),
+        "degree_hours":np.bincount(dayindex,weights=demand,minlength=count),
+        "hours_below_target":np.bincount(dayindex,weights=below,minlength=count),
+        "steps":np.bincount(dayindex[opened],minlength=count),
+        "lag_minutes":np.bincount(dayindex[opened],weights=lags,minlength=count),
+        "max_lag_minutes":maxByDay(dayindex[opened],lags,count),
+    }
+
+
+def maxByDay(dayindex,values,count):
+    result=np.zeros(count)
+    np.maximum.at(result,dayindex,values)
+    return result
+
+
+def emptyDay(day):
+    return {"date":day.isoformat(),"readings":0,"degree_hours":0.0,"hours_below_target":0.0,
+            "steps":0,"lag_minutes":0.0,"max_lag_minutes":0.0}
+
+
+def dailyMetrics(first,last,compiled,zonename,outside_baseline):
+    """
+        Returns a list of per day result dicts for the local dates first to last inclusive,
+        which must be no more than MAX_DAYS apart
+    """
+    if (last-first).days>=MAX_DAYS:
+        raise ValueError("Ranges are limited to %s days" % MAX_DAYS)
+    now=datetime.utcnow()
+    table=tableFor(zonename,min(first.year,now.year),max(last.year,now.year))
+    days=[first+timedelta(days=i) for i in range((last-first).days+1)]
+    profilekeys=profileKeys(compiled)
+    keys=dict((day,"%s%s:%s:%s:%s" % (MEMCACHE_PREFIX,zonename,profilekeys[day.weekday()],outside_baseline,day.isoformat())) for day in days)
+    cached=memcache.get_multi(keys.values())
+    # Days with readings still to come, within the lookaround, are always recomputed and never cached
+    settled=lambda day:localMidnight(day+timedelta(days=1),table)+LOOKAROUND<=toEpoch(now)
+    missing=[day for day in days if not settled(day) or keys[day] not in cached]
+
+    results=dict((day,cached[keys[day]]) for day in days if day not in missing)
+    if missing:
+        computed=dict((day,emptyDay(day)) for day in missing)
+        start=localMidnight(missing[0],table)
+        end=localMidnight(missing[-1]+timedelta(days=1),table)
+        times,actual,outside=loadReadings(start-LOOKAROUND,end+LOOKAROUND)
+        if len(times):
+            daynums,target=targetSeries(compiled,table,times)
+            metrics=computeDays(times,actual,outside,target,daynums,outside_baseline)
+            for i,daynum in enumerate(metrics["days"]):
+                day=(EPOCH+timedelta(days=int(daynum))).date()
+                if day in computed:# Lookaround days are only there to complete their neighbours
+                    computed[day]=dict((name,metrics[name][i].item()) for name in metrics if name!="days")
+                    computed[day]["date"]=day.isoformat()
+        memcache.set_multi(dict((keys[day],computed[day]) for day in missing if settled(day)))
+        results.update(computed)
+    return [results[day] for day in days]
+
+
+def totals(daily):
+    """Combines per day results into totals for the whole range"""
+    total=emptyDay(datetime.utcnow().date())
+    del total["date"]
+    for day in daily:
+        for name in total:
+            if name=="max_lag_minutes":
+                total[name]=max(total[name],day[name])
+            else:
+                total[name]+=day[name]
+    total["mean_lag_minutes"]=total["lag_minutes"]/total["steps"] if total["steps"] else 0.0
+    return total
@@ -1,9 +1,13 @@
-import webapp2,json,logging
+import webapp2,json,logging,bisect,time
 
 from settings import Settings
-from datetime import datetime
+from tztable import TzTable
+from pytz import UnknownTimeZoneError
+import profiler
+import analytics
 from google.appengine.api import users
 import os
+from datetime import datetime,timedelta
 
 import jinja2
 
@@ -12,6 +16,33 @@ JINJA_ENVIRONMENT = jinja2.Environment(
     extensions=['jinja2.ext.autoescape'],
     autoescape=True)
 
+DAYNAMES=["monday","tuesday","wednesday","thursday","friday","saturday","sunday"]
+
+DEFAULT_TIMEZONE="Europe/London"
+
+DEFAULT_OUTSIDE_BASELINE=10.0 # Outside temperature assumed by the analytics when none is reported
+
+VERSION_CHECK_SECONDS=1 # Longest an instance serves profiles without checking for edits elsewhere
+
+DEFAULT_PROFILE=[[0,17],
+                 [5,17],
+                 [6,23],
+                 [7,23],
+                 [8,23],
+                 [9,21],
+                 [10,20],
+                 [12,20],
+                 [14,20],
+                 [16,20],
+                 [17,22],
+                 [18,23],
+                 [19,23],
+                 [20,23],
+                 [21,22],
+                 [22,21],
+                 [23,19],
+                 [23.5,17]]
+
 """
     Simple Programmable thermostat server-side application
 
@@ -23,11 +54,25 @@ JINJA_ENVIRONMENT = jinja2.Environment(
 
     The profiles are retreived and ammended via json endpoints:
 
-    /bothprofilesjson retreives the temperature profiles and any other settings
+    The programmer page arrives with the profiles, target and actual temperatures and
+    the profiles version already embedded as a bootstrap json payload
+
+    /profilesjson retreives the seven day temperature profiles, keyed by day name,
+    with the profiles version (as json) for its ETag so clients can poll with If-None-Match
 
     /getcurrenttemp retreives the required temperature right now
 
-    /setslider?profile=weekdays&hour=12&temp=17.5 changes the stored setting
+    /setslider?profile=monday&hour=12&temp=17.5 changes the stored setting
+
+    /reportactual?actual_temp=19.5&outside_temp=8 records a reading from the thermostat
+    (outside_temp is optional)
+
+    /analyticsjson?start=2026-10-01&end=2026-10-07 returns heating demand per local day
+    and in total for the dates given, the last week by default (see analytics.py)
+
+    /profiler shows admins what the request profiler has collected (see profiler.py)
+
+    Times are local to the zone held in the "timezone" setting (Europe/London by default)
 
 
 
@@ -47,139 +92,171 @@ JINJA_ENVIRONMENT = jinja2.Environment(
 class TempProfiles:
     """
         An instance contains the current temperature profiles,
+        one for each day of the week (Monday first, as datetime.weekday()),
         keeps these up-to-date with changes
         and returns interpolated temperatures
 
         Usage:
 
-            tp=TempProfiles()  - Initialisation provides a typical profile
+            tp=TempProfiles()  - Initialisation provides a typical profile for every day
 
-            tp.load() - will retreive a list of temps from the settings
+            tp.load() - will retreive the day profiles and timezone from the settings
+                        (the timezone is only read here, so changing it takes a new instance)
 
-            tp.tempNow() - will return the current target temp
+            tp.sync() - reloads the profiles if they have been changed by another instance
+
+            tp.tempNow() - will return the current target temp in local time
+
+        Each save stamps a new "profiles_version" setting. sync() peeks at that
+        at most once every VERSION_CHECK_SECONDS and only reloads and recompiles
+        the profiles when it has moved on.
             
     """
     def __init__(self):
         logging.info("Initializing the temp profiles")
-        self.weekdays=[[0,17],
-                       [5,17],
-                       [6,23],
-                       [7,23],
-                       [8,23],
-                       [9,21],
-                       [10,20],
-                       [12,20],
-                       [14,20],
-                       [16,20],
-                       [17,22],
-                       [18,23],
-                       [19,23],
-                       [20,23],
-                       [21,22],
-                       [22,21],
-                       [23,19],
-                       [23.5,17]]
-        
-        self.weekends=self.weekdays
-        
+        self.days=[[list(point) for point in DEFAULT_PROFILE] for day in DAYNAMES]
+        self.tztable=None
+        self.version=None
+        self._checked=None # time.time() of the last version check
+        self.compile()
+
     def load(self):
         logging.info("initial load of settings from datastore")
-        if not settings.weekdays:
-            settings.weekdays=self.weekdays
-            settings.weekends=self.weekends
-        self.weekdays=settings.weekdays
-        self.weekends=settings.weekends
+        if not settings.dayprofiles:
+            if settings.weekdays:
+                # Migrate the old two-profile settings, Monday to Friday then the weekend
+                logging.info("Migrating weekdays and weekends profiles to day profiles")
+                weekends=settings.weekends or settings.weekdays
+                self.days=[[list(point) for point in settings.weekdays] for day in range(5)]
+                self.days+=[[list(point) for point in weekends] for day in range(2)]
+            settings.dayprofiles=self.days
+        # Copied, as settings shares its decoded values and setSlider edits in place
+        self.days=[[list(point) for point in day] for day in settings.dayprofiles]
+        if not settings.timezone:
+            settings.timezone=DEFAULT_TIMEZONE
+        try:
+            self.tztable=TzTable(settings.timezone)
+        except UnknownTimeZoneError:
+            logging.error("Unknown timezone setting %s, using %s instead" % (settings.timezone,DEFAULT_TIMEZONE))
+            self.tztable=TzTable(DEFAULT_TIMEZONE)
+        self.compile()
+        self.version=settings.peek("profiles_version")
+        if self.version==None:
+            # Stamp one now, so sync() has a version to find rather than querying for a missing one
+            self.stampVersion()
+        self._checked=time.time()
 
     def save(self):
         logging.info("saving the settings")
-        settings.weekdays=self.weekdays
-        settings.weekends=self.weekends
-        
+        settings.setone("dayprofiles",self.days)
+        # Written after the profiles so other instances never see a new version with old profiles
+        self.stampVersion()
 
-    def hoursToTemp(self,hours,dayprofile):
-        # Find the points to use for interpolation either side of this time
-        
-        lasttime=dayprofile[-1][0] # might be after the last time in the day profile
-        if hours>=lasttime:
-            nextpoint_time,nextpoint_temp=dayprofile[0]
-            nextpoint=[nextpoint_time+24,nextpoint_temp]
-            prevpoint=dayprofile[-1]
-        elif hours<=dayprofile[0][0]:# might be before the first point in the day
-            nextpoint=dayprofile[0]
-            prevpoint_time,prevpoint_temp=dayprofile[-1]
-            prevpoint=[prevpoint_time-24,prevpoint_temp]
-        else: # In between the rest of the times
-            for i in range(len(dayprofile)-1):# test intervals
-                if dayprofile[i][0]<=hours<=dayprofile[i+1][0]:
-                    prevpoint=dayprofile[i]
-                    nextpoint=dayprofile[i+1]
-                    #logging.info("Found at index %s as hours is %s and hour[i] is %s" % (i,hours,dayprofile[i][0]))
-                    break
-        # Interpolate between prevpoint and nextpoint
-        #logging.info("Time: %s\nPrevious point: %s\nNextPoint: %s\n\n" % (hours,prevpoint,nextpoint))
-        prop_next=1.0*(hours-prevpoint[0])/(nextpoint[0]-prevpoint[0])
-        temp=prevpoint[1]*(1-prop_next)+nextpoint[1]*prop_next
-        return temp
-        
+    def stampVersion(self):
+        # Always moves on, even for two saves in the same millisecond
+        self.version=max(int(time.time()*1000),(self.version or 0)+1)
+        settings.setone("profiles_version",self.version)
+
+    def sync(self):
+        """
+            Reloads the profiles if another instance has saved a new version,
+            checking the version at most once every VERSION_CHECK_SECONDS
+        """
+        now=time.time()
+        if self._checked and now-self._checked<VERSION_CHECK_SECONDS:
+            return
+        self._checked=now
+        version=settings.peek("profiles_version")
+        if version!=self.version:
+            logging.info("Profiles changed from version %s to %s, reloading" % (self.version,version))
+            dayprofiles=settings.peek("dayprofiles")
+            if not dayprofiles:
+                logging.warn("No dayprofiles setting found, saving the profiles in use")
+                self.save()
+                return
+            self.days=[[list(point) for point in day] for day in dayprofiles]
+            # Compiled first, so nothing keyed on the new version sees the old profiles
+            self.compile()
+            self.version=version
+
+    def compile(self):
+        """
+            Precomputes sorted times and temps for each day, with the last point of the
+            day repeated before midnight and the first after, ready for compiledToTemp
+        """
+        compiled=[]
+        for dayprofile in self.days:
+            points=sorted(dayprofile)
+            times=[points[-1][0]-24]+[point[0] for point in points]+[points[0][0]+24]
+            temps=[points[-1][1]]+[point[1] for point in points]+[points[0][1]]
+            compiled.append((times,temps))
+        # Replaced whole, as other request threads may be reading it
+        self._compiled=compiled
+
+    def compiledProfiles(self):
+        """The compiled (times,temps) pair for each day, Monday first, as made by compile()"""
+        return self._compiled
+
+    def compiledToTemp(self,hours,compiled):
+        # Find the points either side of this time by bisection, then interpolate between them
+        times,temps=compiled
+        i=bisect.bisect_right(times,hours)
+        prop_next=1.0*(hours-times[i-1])/(times[i]-times[i-1])
+        return temps[i-1]*(1-prop_next)+temps[i]*prop_next
         
+
     def timeToTemp(self,now):
         """
-            Returns an interpolated temperature for a number of
-            hours through the day
+            Returns an interpolated temperature for a local time,
+            using the profile for that day of the week
         """
-        if now.weekday()>4:
-            dayprofile=self.weekdays
-            logging.info("It's a weekday")
-        else:
-            dayprofile=self.weekends
-            logging.info("It's a weekend")
+        logging.info("It's a %s" % DAYNAMES[now.weekday()])
         # Get the time in the day as hours and fraction of hours
         hours=now.hour+now.minute/60.0
-        return self.hoursToTemp(hours,dayprofile)
+        return self.compiledToTemp(hours,self.compiledProfiles()[now.weekday()])
 
     def tempNow(self):
         # Calculates an interpolated temperature target based
-        # on the day of the week and time of day
-        now=datetime.now()
+        # on the local day of the week and time of day
+        now=self.tztable.localNow()
         temp=self.timeToTemp(now)
         return temp
 
-    def bothProfilesAsJSON(self):
-        pair='{"weekdays":%s,"weekends":%s}' % (self.weekdays,self.weekends)
-        return pair
+    def profilesAsDict(self):
+        return dict(zip(DAYNAMES,self.days))
 
-    def setSlider(self,daytype,hour,temp):
+    def profilesAsJSON(self):
+        return json.dumps(self.profilesAsDict())
 
-        logging.info("updating a temp for %s o'clock to %s deg c" % (hour,temp))
-        changed=False
-        if daytype=="weekends":
-            logging.info("weekend temp change")
-            for i in range(len(self.weekends)):
-                if str(self.weekends[i][0])==hour:
-                    if not self.weekends[i][1]==temp:
-                        logging.info("Updated weekend temp")
-                        self.weekends[i][1]=float(temp)
-                        changed=True
-                        break
-            else:
-                return "FAILED"
-        else:
-            logging.info("weekday temp change")
-            for i in range(len(self.weekdays)):
-                if str(self.weekdays[i][0])==hour:
-                    logging.info("found time")
-                    if not self.weekdays[i][1]==temp:
-                        logging.info("Updated weekday temp")
-                        self.weekdays[i][1]=float(temp)
-                        changed=True
-                        break
-            else:
-                return "FAILED"
+    def bootstrapAsJSON(self,actual_temp):
+        """
+            Everything the programmer page needs for its first paint, safe to
+            embed in a script tag
+        """
+        bootstrap={
+            "profiles":self.profilesAsDict(),
+            "version":self.version,
+            "target":round(self.tempNow(),1),
+            "actual":actual_temp,
+        }
+        return json.dumps(bootstrap).replace("</","<\\/")
 
+    def setSlider(self,daytype,hour,temp):
 
+        logging.info("updating a %s temp for %s o'clock to %s deg c" % (daytype,hour,temp))
+        if daytype not in DAYNAMES:
+            return "FAILED"
+        dayprofile=self.days[DAYNAMES.index(daytype)]
+        for point in dayprofile:
+            if str(point[0])==hour:
+                break
+        else:
+            return "FAILED"
 
-        if changed:
+        if point[1]!=float(temp):
             logging.info("updating stored values")
+            point[1]=float(temp)
+            self.compile()
             self.save()
             
         
@@ -208,20 +285,28 @@ class MainPage(webapp2.RequestHandler):
             'url_linktext': url_linktext,
         }
         if user and "french" in user.email():
-            template_values["targ_temp"]="%.1f" %temp_profiles.tempNow()
-            template_values["act_temp"]=settings.actual_temp
+            temp_profiles.sync()
+            template_values["bootstrap"]=temp_profiles.bootstrapAsJSON(settings.actual_temp)
             template = JINJA_ENVIRONMENT.get_template('statics/programmer.html')
         else:
             template = JINJA_ENVIRONMENT.get_template('statics/needtologin.html')
         self.response.write(template.render(template_values))
             
-class GetBothProfilesAsJSON(webapp2.RequestHandler):
+class GetProfilesAsJSON(webapp2.RequestHandler):
     def get(self):
-        self.response.headers['Contet-Type']='application/json'
-        self.response.write(temp_profiles.bothProfilesAsJSON())
+        temp_profiles.sync()
+        etag='"%s"' % json.dumps(temp_profiles.version)
+        self.response.headers['ETag']=etag
+        self.response.headers['Cache-Control']='no-cache'# Cacheable, but always revalidate
+        if self.request.headers.get('If-None-Match','').replace('W/','')==etag:
+            self.response.set_status(304)
+            return
+        self.response.headers['Content-Type']='application/json'
+        self.response.write(temp_profiles.profilesAsJSON())
 
 class GetCurrentTemperature(webapp2.RequestHandler):
     def get(self):
+        temp_profiles.sync()
         self.response.headers['Content-Type']='application/json'
         self.response.write(temp_profiles.tempNow())
 
@@ -236,9 +321,12 @@ class SetSlider(webapp2.RequestHandler):
             hour=self.request.get("hour")
             temp=self.request.get("temp")
             logging.info("Processing slider request: profile- {profile}, hour- {hour}, temp- {temp}".format(profile=profile,hour=hour,temp=temp))
-            temp_profiles.setSlider(profile,hour,temp)
+            temp_profiles.sync()
+            # The version this edit was applied to, which may be newer than the page's if another instance saved since
+            from_version=temp_profiles.version
+            result=temp_profiles.setSlider(profile,hour,temp) or "OK"
             self.response.headers['Content-Type']='application/json'
-            self.response.write('"OK"')
+            self.response.write(json.dumps({"result":result,"from_version":from_version,"version":temp_profiles.version}))
         else:
             self.response.write("NOT LOGGED IN")
         
@@ -246,16 +334,83 @@ class ReportActual(webapp2.RequestHandler):
     def get(self):
         actual_temp=self.request.get("actual_temp")
         settings.actual_temp=actual_temp
+        outside_temp=self.request.get("outside_temp")
+        try:
+            analytics.recordReading(float(actual_temp),float(outside_temp) if outside_temp else None)
+        except ValueError:
+            logging.warn("Not recording unreadable temperatures: %s, %s" % (actual_temp,outside_temp))
+        
+        
+        
+class GetAnalytics(webapp2.RequestHandler):
+    """
+        Heating demand per local day, and in total, for a range of dates
+    """
+    def get(self):
+        user = users.get_current_user()
+        if not (user and "french" in user.email()):
+            self.response.write("NOT LOGGED IN")
+            return
+        temp_profiles.sync()
+        today=temp_profiles.tztable.localNow().date()
+        try:
+            last=self.parseDate("end",today)
+            first=self.parseDate("start",last-timedelta(days=6))
+        except ValueError:
+            self.abort(400,detail="Dates should be YYYY-MM-DD")
+        if first>last:
+            self.abort(400,detail="start is after end")
+        if first.year<1970 or last>today:
+            self.abort(400,detail="Dates should be between 1970 and today")
+        if (last-first).days>=analytics.MAX_DAYS:
+            self.abort(400,detail="Ranges are limited to %s days" % analytics.MAX_DAYS)
+        baseline=settings.outside_baseline
+        if baseline==None:
+            baseline=DEFAULT_OUTSIDE_BASELINE
+        daily=analytics.dailyMetrics(first,last,temp_profiles.compiledProfiles(),
+                                     temp_profiles.tztable.zonename,baseline)
+        self.response.headers['Content-Type']='application/json'
+        self.response.write(json.dumps({"days":daily,"totals":analytics.totals(daily)}))
+
+    def parseDate(self,name,default):
+        text=self.request.get(name)
+        if not text:
+            return default
+        return datetime.strptime(text,"%Y-%m-%d").date()
+        
+        
+        
+class ProfilerReport(webapp2.RequestHandler):
+    """
+        Admin only view of the requests profiled on this instance
+    """
+    def get(self):
+        if not users.is_current_user_admin():
+            self.abort(403)
+        self.response.headers['Content-Type']='text/plain'
+        if self.request.get("reset"):
+            profiler.aggregate.reset()
+            self.response.write("Profiler reset\n")
+        elif self.request.get("format")=="collapsed":
+            self.response.write(profiler.aggregate.collapsedStacks())
+        else:
+            sort=self.request.get("sort","cumulative")
+            if sort not in profiler.SORT_KEYS:
+                self.abort(400,detail="sort should be one of %s" % ", ".join(sorted(profiler.SORT_KEYS)))
+            self.response.write(profiler.aggregate.topCallSites(sort=sort))
         
         
         
 app = webapp2.WSGIApplication([
-    ('/bothprofilesjson',GetBothProfilesAsJSON),
+    ('/profilesjson',GetProfilesAsJSON),
     ('/getcurrenttemp',GetCurrentTemperature),
     ('/setslider',SetSlider),
     ('/reportactual',ReportActual),
+    ('/analyticsjson',GetAnalytics),
+    ('/profiler',ProfilerReport),
     ('/', MainPage),
 ], debug=True)
+app = profiler.ProfilerMiddleware(app)
       
 logging.info("Loading up the settings")
 settings=Settings(maxage=10)# Load the application settings
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""
+
+        Request Profiler
+        ================
+
+        Opt-in WSGI middleware that profiles a sample of requests and keeps the
+        results, aggregated across requests, in memory on the instance
+
+
+        usage:
+                from profiler import ProfilerMiddleware
+
+                app=ProfilerMiddleware(webapp2.WSGIApplication([...]))
+
+        A request is profiled when either:
+            a random sample picks it, at the rate set by the PROFILER_SAMPLE_RATE
+            environment variable in app.yaml (0 to 1, default 0 ie. off)
+
+            or it carries an "X-Profile-Request" header and the user is an App Engine admin
+
+        Each profiled request is run under cProfile, adding to the instance wide call
+        statistics, while a sampling thread records its stacks every SAMPLE_INTERVAL seconds.
+
+        Anything else passes straight through, so when it is off it costs a random
+        number and a dictionary lookup per request.
+
+        Results are read from aggregate, which the /profiler admin page in main.py serves:
+
+                /profiler                   top call sites by cumulative time
+                /profiler?sort=tottime      top call sites by own time (any of SORT_KEYS)
+                /profiler?format=collapsed  stacks as "frame;frame;frame count" lines for flamegraph.pl or speedscope
+                /profiler?reset=1           clear everything collected so far
+
+"""
+
+import logging,os,sys,random,threading,cProfile,pstats
+from collections import Counter
+from StringIO import StringIO
+
+from google.appengine.api import users
+
+SAMPLE_INTERVAL=0.005 # Seconds between stack samples of a profiled request
+
+HEADER_KEY="HTTP_X_PROFILE_REQUEST" # X-Profile-Request as it appears in the WSGI environ
+
+SORT_KEYS=pstats.Stats.sort_arg_dict_default # Orders topCallSites() accepts
+
+
+class StackSampler(threading.Thread):
+    """
+        Records the stack of another thread at intervals until stopped
+    """
+    def __init__(self,thread_id,interval=SAMPLE_INTERVAL):
+        threading.Thread.__init__(self)
+        self.daemon=True
+        self.thread_id=thread_id
+        self.interval=interval
+        self.stacks=Counter() # Collapsed stack: number of samples
+        self._done=threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame=sys._current_frames().get(self.thread_id)
+            stack=[]
+            while frame is not None:
+                code=frame.f_code
+                stack.append("%s (%s:%s)" % (code.co_name,os.path.basename(code.co_filename),code.co_firstlineno))
+                frame=frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))]+=1
+
+    def finish(self):
+        self._done.set()
+        self.join()
+
+
+class Aggregate(object):
+    """
+        Profiles and stacks collected from all the profiled requests on this instance
+    """
+    def __init__(self):
+        self._lock=threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stats=None
+            self.stacks=Counter()
+            self.requests=Counter() # Path: number of profiled requests
+
+    def add(self,path,profile,stacks):
+        with self._lock:
+            if self.stats==None:
+                self.stats=pstats.Stats(profile,stream=StringIO())
+            else:
+                self.stats.add(profile)
+            self.stacks.update(stacks)
+            self.requests[path]+=1
+
+    def topCallSites(self,sort="cumulative",limit=40):
+        """Returns the pstats listing of the hottest functions as text"""
+        with self._lock:
+            if self.stats==None:
+                return "No requests profiled yet\n"
+            out=StringIO()
+            self.stats.stream=out
+            self.stats.sort_stats(sort).print_stats(limit)
+            requests="\n".join("%6d %s" % (count,path) for path,count in self.requests.most_common())
+            return "Profiled requests:\n%s\n%s" % (requests,out.getvalue())
+
+    def collapsedStacks(self):
+        """Returns the sampled stacks in the collapsed format flame graph tools read"""
+        with self._lock:
+            return "".join("%s %s\n" % (stack,count) for stack,count in self.stacks.most_common())
+
+
+aggregate=Aggregate()# Shared by every app wrapped on this instance
+
+
+class ProfilerMiddleware(object):
+    """
+        Wraps a WSGI app, profiling sampled or admin flagged requests into aggregate
+    """
+    def __init__(self,app,sample_rate=None):
+        self.app=app
+        if sample_rate==None:
+            sample_rate=float(os.environ.get("PROFILER_SAMPLE_RATE","0"))
+        self.sample_rate=sample_rate
+
+    def wanted(self,environ):
+        if HEADER_KEY in environ and users.is_current_user_admin():
+            return True
+        return self.sample_rate>0 and random.random()<self.sample_rate
+
+    def __call__(self,environ,start_response):
+        if not self.wanted(environ):
+            return self.app(environ,start_response)
+        path=environ.get("PATH_INFO","")
+        logging.info("Profiling request for %s" % path)
+        sampler=StackSampler(threading.current_thread().ident)
+        profile=cProfile.Profile()
+        sampler.start()
+        try:
+            return profile.runcall(self.app,environ,start_response)
+        finally:
+            sampler.finish()
+            aggregate.add(path,profile,sampler.stacks)
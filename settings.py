@@ -24,11 +24,21 @@
 
                 settings.forcerefresh()     # Refreshes all the settings unconditionally
 
+                settings.peek("thing")      # Reads just "thing" from memcache (or the datastore), ignoring the cache age
+
         Has hardcoded limit of 1000 settings, but frankly that'd be horrible to use this for!
 
         If the object presented is a string, a float or an int it is stored as a string representation of such and enttype is set accordingly
         otherwise, e.g. for more complex objects a jsonpickled version is stored (to allow human editing when settings is visited)
 
+        The conversions for each enttype live in CODECS. A refresh only keeps the raw stored text,
+        each value is decoded the first time it is read after its text changes, so large json
+        settings cost nothing on refresh unless they were edited. Decoded values are shared between
+        reads, so copy them before changing them in place.
+
+        Every write also puts the raw value in memcache, so peek() gives any instance a cheap, current
+        read of a single small setting (such as a version marker) without a full refresh.
+
         add a settings handle to the app.yaml like this:
 
         - url: /settings*
@@ -45,8 +55,47 @@
 """
 
 import logging,webapp2,json
+from collections import namedtuple
 from google.appengine.ext import ndb
+from google.appengine.api import memcache
 from datetime import datetime,timedelta
+from profiler import ProfilerMiddleware
+
+
+Codec=namedtuple("Codec",["decode","encode"])
+
+def decodeBoolean(text):
+    """Booleans are stored as the text "True" or "False" """
+    return text=="True"
+
+def identity(text):
+    return text
+
+# Converts between the stored text and the python value for each enttype
+# Entities without an enttype are strings, unknown enttypes are treated as json
+CODECS={
+    "int":Codec(int,str),
+    "float":Codec(float,str),
+    "boolean":Codec(decodeBoolean,str),
+    "string":Codec(identity,str),
+    "json":Codec(json.loads,json.dumps),
+}
+
+def codecFor(enttype):
+    return CODECS.get(enttype or "string",CODECS["json"])
+
+MEMCACHE_PREFIX="setting:"
+
+def cacheEntry(entry):
+    """Shares the latest raw value of a setting with the other instances"""
+    memcache.set(MEMCACHE_PREFIX+entry.keyname,(entry.enttype,entry.value))
+
+def fillCache(entry):
+    """
+        Fills memcache with a value just read from the datastore, unless a write
+        has put a newer one there since
+    """
+    memcache.add(MEMCACHE_PREFIX+entry.keyname,(entry.enttype,entry.value))
 
 
 
@@ -67,8 +116,10 @@ class Settings(object):
         #logging.info("Initialising settings")
         self._maxage=maxage # In seconds
         self._lastloaded=None # Datetime for the last load of the settings
-        #self.forcerefresh() # Set up settings first time
-        if self._settings=={}:# We have nothing at all so set up the dummy (needed so you can use console to manage)
+        self._raw={} # keyname: (enttype,stored text) as last loaded
+        self._decoded={} # keyname: (enttype,stored text,value) for values decoded so far
+        self.refresh() # Set up settings first time
+        if self._raw=={}:# We have nothing at all so set up the dummy (needed so you can use console to manage)
             logging.warn("No old settings, creating a dummy record- can be deleted once real data is available")
             dummy=SettingStore()
             dummy.keyname="DummyKey"
@@ -94,36 +145,20 @@ class Settings(object):
             #logging.info("Modifying keyname: %s to value %s" % (keyname,newvalue))
             entry=entries[0]
 
-            # Validate thta they newvalue matches the enttype
-            if type(newvalue)==int:
-                try:
-                    newvalue=int(newvalue)
-                except ValueError:
-                    raise Exception("Could not convert to int")
-                else:
-                    storevalue=str(newvalue)
-            elif type(newvalue)==float:
-                try:
-                    newvalue=float(newvalue)
-                except ValueError:
-                    raise Exception("Could not convert to float")
-                else:
-                    storevalue=str(newvalue)
-            elif type(newvalue)==bool:
-                try:
-                    newvalue=(newvalue=="True")
-                except ValueError:
-                    raise Exception("Could not cast to bool")
-                else:
-                    storevalue=str(newvalue)
-            else:
-                storevalue=str(newvalue)
+            # Store using the existing enttype, checking it reads back
+            codec=codecFor(entry.enttype)
+            storevalue=codec.encode(newvalue)
+            try:
+                codec.decode(storevalue)
+            except ValueError:
+                raise Exception("Could not convert %s to %s" % (newvalue,entry.enttype))
 
 
             # Modify the existing entry
             
             entry.value=storevalue
             entry.put()
+            cacheEntry(entry)
 
         elif len(entries)==0:
             #logging.info( "Creating new setting keyname: %s to newvalue: %s " % (keyname,newvalue))
@@ -133,28 +168,28 @@ class Settings(object):
             
             if type(newvalue)==int:
                 s.enttype="int"
-                s.value=str(newvalue)
             elif type(newvalue)==float:
                 s.enttype="float"
-                s.value=str(newvalue)
-
             elif type(newvalue)==str:
                 s.enttype="string"
-                s.value=newvalue
             elif type(newvalue)==bool:
                 s.enttype="boolean"
-                s.value=str(newvalue)
             else:
                 #Assume it is a json serealizable element
                 s.enttype="json"
-                s.value=json.dumps(newvalue)
+            s.value=CODECS[s.enttype].encode(newvalue)
                 
 
             s.put()
+            cacheEntry(s)
+            entry=s
         else:
             logging.error("Strange- we seem to have %s instances of a settings called %s" % (len(entries),keyname))
+            return
 
-        self._settings[keyname]=newvalue# Set local cache of that value
+        # Set local cache of that value, decoded afresh by get() rather than sharing the caller's object
+        self._raw[keyname]=(entry.enttype,entry.value)
+        self._decoded.pop(keyname,None)
         
     def setmaxage(self,maxage):
         """
@@ -172,22 +207,49 @@ class Settings(object):
         qry=SettingStore.query()
         sets=qry.fetch(1000)# Return up to 1000 records
         self._lastloaded=datetime.utcnow()
-        newsettings={}
-        for set in sets:
-            if set.enttype=="int":
-                val=int(set.value)
-            elif set.enttype=="float":
-                val=float(set.value)
-            elif set.enttype=="boolean":
-                val=(set.value==True)
-            elif set.enttype=="string":
-                val=set.value
-            else:
-                val=json.loads(set.value)
-            newsettings[set.keyname]=val
-        self._settings=newsettings # replace the old settings
+        # Only the raw text is kept, values are decoded on first use in get()
+        self._raw=dict((set.keyname,(set.enttype,set.value)) for set in sets) # replace the old settings
+        for keyname in list(self._decoded):
+            if keyname not in self._raw:
+                self._decoded.pop(keyname,None)
         #logging.info("Loaded new data into settings")
 
+    def get(self,keyname):
+        """
+            Returns the decoded value for keyname from the cache, or None if it isn't there
+
+            Decoding is memoized against the stored text, so an unchanged value
+            is only decoded once however many times the cache is refreshed
+        """
+        raw=self._raw.get(keyname,None)
+        if raw==None:
+            return None
+        decoded=self._decoded.get(keyname,None)
+        if decoded and decoded[:2]==raw:
+            return decoded[2]
+        enttype,text=raw
+        val=codecFor(enttype).decode(text)
+        self._decoded[keyname]=(enttype,text,val)
+        return val
+
+
+    def peek(self,keyname):
+        """
+            Returns the current value of a single setting, regardless of the age of the cache
+
+            Reads memcache, falling back to a query for just that entity, and updates only
+            that entry in the local cache. Meant for small values checked often.
+        """
+        raw=memcache.get(MEMCACHE_PREFIX+keyname)
+        if raw==None:
+            entries=SettingStore.query(SettingStore.keyname==keyname).fetch(1)
+            if not entries:
+                self._raw.pop(keyname,None)
+                return None
+            fillCache(entries[0])
+            raw=(entries[0].enttype,entries[0].value)
+        self._raw[keyname]=raw
+        return self.get(keyname)
 
     def refresh(self):
         """
@@ -213,13 +275,14 @@ class Settings(object):
                 
                 However, if it still does not exist, then None is returned
         """
+        if keyname[0]=="_":
+            # Missing instance attribute, not a setting
+            raise AttributeError(keyname)
         self.refresh()
-        res=self._settings.get(keyname,None)
-        if not res:
+        if keyname not in self._raw:
             self.forcerefresh()
-            res=self._settings.get(keyname,None)
     
-        return res
+        return self.get(keyname)
 
     def __setattr__(self,keyname,newvalue):
         """
@@ -363,27 +426,19 @@ class ModifySetting(webapp2.RequestHandler):
         enttype=self.request.get("enttype")
         keyname=self.request.get("keyname")
         valtext=self.request.get("value")
-        if enttype=="int":
-            v=int(valtext)
-            value=valtext
-        elif enttype=="float":
-            v=float(valtext)
-            value=valtext
-        elif enttype=="string":
-            value=valtext
-        elif enttype=="json":
-            value=valtext
-        elif enttype=="boolean":
-            assert valtext in ["False","True"],"Wierd error where somehow a non boolean value was returned from teh form"
-            value=valtext
-        else:
+        if enttype not in CODECS:
             raise Exception("Unexpected type from form entry- %s - strange" % enttype)
+        if enttype=="boolean":
+            assert valtext in ["False","True"],"Wierd error where somehow a non boolean value was returned from teh form"
+        CODECS[enttype].decode(valtext)# Check it will read back
+        value=valtext
         
         qry=SettingStore.query(SettingStore.keyname==keyname)
         entries=qry.fetch(1)
         entry=entries[0]
         entry.value=value
         entry.put()
+        cacheEntry(entry)
         self.response.write("""<h3>
 Updated value of %s</h3><p>New value is:<br />
 <pre>%s</pre>
@@ -425,6 +480,7 @@ class CreateNewEntry(webapp2.RequestHandler):
         newEntity.enttype=enttype
         newEntity.value='"None Yet!"'
         newEntity.put()
+        cacheEntry(newEntity)
         r="""
             <h3>Set up a new setting of keyname: %s and type: %s</h3>
             <script>
@@ -446,6 +502,7 @@ class DeleteSetting(webapp2.RequestHandler):
         entries=qry.fetch(1)
         entry=entries[0]
         entry.key.delete()
+        memcache.delete(MEMCACHE_PREFIX+keyname)
         r="""<h3>Entry for %s deleted</h3>
                     <script>
                 window.setTimeout(backtolist,3000);
@@ -519,6 +576,7 @@ app = webapp2.WSGIApplication([
     ('/settings/createnewentry/',CreateNewEntry),
     ('/settings', MainHandler)
 ], debug=True)
+app = ProfilerMiddleware(app)
 logging.info("Settings available at /settings")
 
 
@@ -0,0 +1,187 @@
+"""
+    Stand-ins for the App Engine SDK, webapp2 and jinja2, so the modules can be
+    imported and tested outside the dev server
+
+    ndb keeps entities in a list and only understands the equality filters
+    the app uses, memcache is a dict, and templates just record what they
+    were rendered with
+
+    The call fixture runs a request handler's get() and returns its response
+"""
+
+import io,os,sys,types
+
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeProperty(object):
+    def __init__(self,**kwargs):
+        self.name=None
+
+    def __eq__(self,other):
+        return (self.name,other)
+
+
+class FakeQuery(object):
+    def __init__(self,model,filters):
+        self.model=model
+        self.filters=filters
+
+    def fetch(self,limit):
+        matches=[entity for entity in self.model._store
+                 if all(getattr(entity,name)==value for name,value in self.filters)]
+        return matches[:limit]
+
+
+class FakeKey(object):
+    def __init__(self,entity):
+        self.entity=entity
+
+    def delete(self):
+        type(self.entity)._store.remove(self.entity)
+
+
+class FakeModelMeta(type):
+    def __init__(cls,name,bases,attrs):
+        type.__init__(cls,name,bases,attrs)
+        cls._store=[]
+        for attrname,value in attrs.items():
+            if isinstance(value,FakeProperty):
+                value.name=attrname
+
+
+class FakeModel(FakeModelMeta("FakeModelBase",(object,),{})):
+    def __init__(self):
+        for attrname in dir(type(self)):
+            if isinstance(getattr(type(self),attrname),FakeProperty):
+                setattr(self,attrname,None)
+        self.key=FakeKey(self)
+
+    @classmethod
+    def query(cls,*filters):
+        return FakeQuery(cls,filters)
+
+    def put(self):
+        if self not in type(self)._store:
+            type(self)._store.append(self)
+
+
+def module(name,**attrs):
+    mod=types.ModuleType(name)
+    mod.__dict__.update(attrs)
+    sys.modules[name]=mod
+    return mod
+
+
+memcache_data={}
+
+ndb=module("google.appengine.ext.ndb",Model=FakeModel,
+           StringProperty=FakeProperty,TextProperty=FakeProperty,
+           FloatProperty=FakeProperty,DateTimeProperty=FakeProperty)
+def memcacheAdd(key,value):
+    if key in memcache_data:
+        return False
+    memcache_data[key]=value
+    return True
+
+memcache=module("google.appengine.api.memcache",
+                get=memcache_data.get,
+                set=memcache_data.__setitem__,
+                add=memcacheAdd,
+                delete=lambda key:memcache_data.pop(key,None),
+                get_multi=lambda keys:dict((key,memcache_data[key]) for key in keys if key in memcache_data),
+                set_multi=memcache_data.update,
+                flush_all=memcache_data.clear)
+users=module("google.appengine.api.users",is_current_user_admin=lambda:False,get_current_user=lambda:None,
+             create_login_url=lambda uri:"/login",create_logout_url=lambda uri:"/logout")
+module("google",appengine=module("google.appengine",
+                                 ext=module("google.appengine.ext",ndb=ndb),
+                                 api=module("google.appengine.api",memcache=memcache,users=users)))
+
+
+class HTTPAbort(Exception):
+    def __init__(self,code,detail=None):
+        Exception.__init__(self,code,detail)
+        self.code=code
+
+
+class FakeRequest(object):
+    def __init__(self,params=None,headers=None):
+        self.params=params or {}
+        self.headers=headers or {}
+        self.uri="/"
+
+    def get(self,name,default=""):
+        return self.params.get(name,default)
+
+
+class FakeResponse(object):
+    def __init__(self):
+        self.headers={}
+        self.status=200
+        self.body=""
+
+    def write(self,text):
+        self.body+=text
+
+    def set_status(self,code):
+        self.status=code
+
+
+class FakeRequestHandler(object):
+    def __init__(self,request=None,response=None):
+        self.request=request or FakeRequest()
+        self.response=response or FakeResponse()
+
+    def abort(self,code,detail=None):
+        raise HTTPAbort(code,detail)
+
+module("webapp2",RequestHandler=FakeRequestHandler,WSGIApplication=lambda routes,debug=False:None)
+sys.modules.setdefault("StringIO",io)
+
+
+class FakeTemplate(object):
+    def __init__(self,name):
+        self.name=name
+
+    def render(self,values):
+        self.values=values
+        return ""
+
+
+class FakeEnvironment(object):
+    def __init__(self,**kwargs):
+        self.rendered=[]
+
+    def get_template(self,name):
+        template=FakeTemplate(name)
+        self.rendered.append(template)
+        return template
+
+module("jinja2",Environment=FakeEnvironment,FileSystemLoader=lambda path:None)
+
+
+class FakeUser(object):
+    def __init__(self,email):
+        self._email=email
+
+    def email(self):
+        return self._email
+
+
+@pytest.fixture
+def call():
+    """Runs handler.get() with the params and headers given, returning the response"""
+    def run(handler,params=None,headers=None):
+        instance=handler(FakeRequest(params,headers),FakeResponse())
+        instance.get()
+        return instance.response
+    return run
+
+
+@pytest.fixture
+def french(monkeypatch):
+    """Logs in as someone allowed to use the programmer"""
+    monkeypatch.setattr(users,"get_current_user",lambda:FakeUser("someone@french.example"))
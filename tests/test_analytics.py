@@ -0,0 +1,107 @@
+from datetime import date,datetime,timedelta
+
+import pytest
+
+np=pytest.importorskip("numpy")
+pytest.importorskip("pytz")
+
+import analytics
+from analytics import computeDays
+
+
+FLAT=[([-24.0,48.0],[20.0,20.0])]*7 # 20 degrees all day, every day
+
+
+def series(minutes,actual,target):
+    times=np.array(minutes,dtype=np.int64)*60
+    count=len(times)
+    return times,np.array(actual,dtype=float),np.zeros(count),np.array(target,dtype=float),np.zeros(count,dtype=np.int64)
+
+
+def test_step_needs_a_rising_target():
+    # Actual drops away from a steady target, eg. a window opening
+    metrics=computeDays(*series([0,10,20,30],[20,18,18,20],[20,20,20,20]),outside_baseline=10)
+    assert metrics["steps"][0]==0
+
+
+def test_step_lag_measured_to_catching_up():
+    metrics=computeDays(*series([0,10,20,30],[18,18,19,20],[18,20,20,20]),outside_baseline=10)
+    assert metrics["steps"][0]==1
+    assert metrics["lag_minutes"][0]==20
+    assert metrics["max_lag_minutes"][0]==20
+
+
+def test_openings_before_catching_up_count_once():
+    # The target rises again at 30 minutes while actual is still catching up with the first step
+    metrics=computeDays(*series([0,10,20,30,40],[18,18,19.2,19.5,22],[18,20,20,22,22]),outside_baseline=10)
+    assert metrics["steps"][0]==1
+    assert metrics["lag_minutes"][0]==30
+
+
+def test_readings_hold_until_next_up_to_max_gap():
+    # Outside is reported as 0, so each hour held is 20 degree hours
+    metrics=computeDays(*series([0,30,30+600],[20,20,20],[20,20,20]),outside_baseline=10)
+    assert metrics["degree_hours"][0]==pytest.approx(20*(0.5+analytics.MAX_GAP/3600.0))
+
+
+def test_day_results_do_not_depend_on_range(monkeypatch):
+    start=analytics.toEpoch(datetime(2020,1,6))
+    times=np.arange(start,start+3*86400,1800,dtype=np.int64)
+    actual=np.where((times//3600)%24<6,17.0,21.0)
+    monkeypatch.setattr(analytics,"loadReadings",
+                        lambda first,last:(times[(times>=first)&(times<last)],
+                                           actual[(times>=first)&(times<last)],
+                                           np.full(((times>=first)&(times<last)).sum(),np.nan)))
+    analytics.memcache.flush_all()
+    alone=analytics.dailyMetrics(date(2020,1,6),date(2020,1,6),FLAT,"UTC",10.0)
+    analytics.memcache.flush_all()
+    within=analytics.dailyMetrics(date(2020,1,6),date(2020,1,8),FLAT,"UTC",10.0)
+    assert alone[0]==within[0]
+    assert alone[0]["degree_hours"]==pytest.approx(240)
+
+
+def test_range_is_limited():
+    with pytest.raises(ValueError):
+        analytics.dailyMetrics(date(2020,1,1),date(2021,6,1),FLAT,"UTC",10.0)
+
+
+def test_totals_always_has_mean_lag():
+    assert analytics.totals([analytics.emptyDay(date(2020,1,1))])["mean_lag_minutes"]==0.0
+
+
+@pytest.mark.parametrize("zonename,day,utc",[
+    ("Europe/London",date(2026,1,15),datetime(2026,1,15,0)),
+    ("Europe/London",date(2026,7,15),datetime(2026,7,14,23)),
+    ("Europe/London",date(2026,3,29),datetime(2026,3,29,0)), # Clocks change at 01:00 UTC, after midnight
+    # Summer time ended at midnight, so the 18th began at midnight -03:00
+    ("America/Sao_Paulo",date(2018,2,18),datetime(2018,2,18,3)),
+    # Summer time began at midnight, skipping to 01:00 -02:00
+    ("America/Sao_Paulo",date(2018,11,4),datetime(2018,11,4,3)),
+    ("America/Sao_Paulo",date(2018,11,5),datetime(2018,11,5,2)),
+])
+def test_local_midnight(zonename,day,utc):
+    table=analytics.tableFor(zonename,day.year,day.year)
+    assert analytics.localMidnight(day,table)==analytics.toEpoch(utc)
+
+
+def test_profile_keys_only_change_for_days_using_the_edit():
+    before=analytics.profileKeys(FLAT)
+    edited=list(FLAT)
+    edited[0]=([-24.0,48.0],[21.0,21.0]) # Monday
+    after=analytics.profileKeys(edited)
+    changed=[weekday for weekday in range(7) if before[weekday]!=after[weekday]]
+    assert changed==[0,1,6] # Monday, and Tuesday and Sunday through the lookaround
+
+
+def test_cached_days_survive_edits_to_other_days(monkeypatch):
+    # One reading at noon each day of the week of Monday 6th January 2020
+    noons=np.array([analytics.toEpoch(datetime(2020,1,6+i,12)) for i in range(7)],dtype=np.int64)
+    monkeypatch.setattr(analytics,"loadReadings",lambda first,last:(noons,np.full(7,18.0),np.full(7,np.nan)))
+    analytics.memcache.flush_all()
+    analytics.dailyMetrics(date(2020,1,6),date(2020,1,12),FLAT,"UTC",10.0)
+    edited=list(FLAT)
+    edited[0]=([-24.0,48.0],[21.0,21.0]) # Monday
+    # With no readings now, recomputed days show none, while cached ones keep theirs
+    monkeypatch.setattr(analytics,"loadReadings",lambda first,last:(np.array([],dtype=np.int64),np.array([]),np.array([])))
+    daily=analytics.dailyMetrics(date(2020,1,6),date(2020,1,12),edited,"UTC",10.0)
+    assert [day["readings"] for day in daily]==[0,0,1,1,1,1,0]
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+pytest.importorskip("pytz")
+pytest.importorskip("numpy")
+
+import main
+import settings
+from main import TempProfiles
+
+
+@pytest.fixture
+def profiles(monkeypatch):
+    """A freshly loaded TempProfiles in place of main's, over an empty datastore"""
+    del settings.SettingStore._store[:]
+    settings.memcache.flush_all()
+    main.settings.forcerefresh()
+    tp=TempProfiles()
+    tp.load()
+    monkeypatch.setattr(main,"temp_profiles",tp)
+    return tp
+
+
+def etag(version):
+    return '"%s"' % json.dumps(version)
+
+
+def test_profiles_etag_is_the_version_as_json(profiles,call):
+    response=call(main.GetProfilesAsJSON)
+    assert response.status==200
+    assert response.headers["ETag"]==etag(profiles.version)
+    assert json.loads(response.body)==profiles.profilesAsDict()
+
+
+@pytest.mark.parametrize("prefix",["","W/"])
+def test_profiles_not_modified_for_matching_etag(profiles,call,prefix):
+    response=call(main.GetProfilesAsJSON,headers={"If-None-Match":prefix+etag(profiles.version)})
+    assert response.status==304
+    assert response.body==""
+
+
+def test_profiles_sent_for_old_etag(profiles,call):
+    response=call(main.GetProfilesAsJSON,headers={"If-None-Match":etag(None)})
+    assert response.status==200
+    assert json.loads(response.body)["monday"]==profiles.days[0]
+
+
+def test_bootstrap_embedded_safely(profiles,call,french):
+    main.settings.actual_temp="</script><script>alert(1)"
+    call(main.MainPage)
+    template=main.JINJA_ENVIRONMENT.rendered[-1]
+    assert template.name=="statics/programmer.html"
+    payload=template.values["bootstrap"]
+    assert "</" not in payload
+    bootstrap=json.loads(payload)
+    assert bootstrap["actual"]=="</script><script>alert(1)"
+    assert bootstrap["version"]==profiles.version
+    assert bootstrap["profiles"]==profiles.profilesAsDict()
+    assert bootstrap["target"]==round(profiles.tempNow(),1)
+
+
+def test_setslider_reports_versions(profiles,call,french):
+    before=profiles.version
+    response=json.loads(call(main.SetSlider,params={"profile":"monday","hour":"12","temp":"25"}).body)
+    assert response["result"]=="OK"
+    assert response["from_version"]==before
+    assert response["version"]==profiles.version!=before
+
+
+def test_setslider_from_version_shows_edits_elsewhere(profiles,call,french):
+    pageversion=profiles.version
+    other=TempProfiles()
+    other.load()
+    other.setSlider("friday","12","24")
+    profiles._checked-=main.VERSION_CHECK_SECONDS
+    response=json.loads(call(main.SetSlider,params={"profile":"monday","hour":"12","temp":"25"}).body)
+    assert response["from_version"]==other.version!=pageversion
+
+
+def test_setslider_failure_keeps_version(profiles,call,french):
+    response=json.loads(call(main.SetSlider,params={"profile":"someday","hour":"12","temp":"25"}).body)
+    assert response["result"]=="FAILED"
+    assert response["from_version"]==response["version"]==profiles.version
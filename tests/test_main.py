@@ -0,0 +1,104 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("pytz")
+pytest.importorskip("numpy")
+
+import main
+import settings
+from main import DAYNAMES,TempProfiles
+
+
+@pytest.fixture
+def store():
+    """Empties the datastore and memcache, leaving main's settings freshly loaded"""
+    del settings.SettingStore._store[:]
+    settings.memcache.flush_all()
+    main.settings.forcerefresh()
+    return settings.SettingStore._store
+
+
+def flat(temp):
+    return [[0,temp],[12,temp]]
+
+
+def loaded(days):
+    tp=TempProfiles()
+    main.settings.dayprofiles=days
+    tp.load()
+    return tp
+
+
+def test_weekday_selects_that_days_profile(store):
+    tp=loaded([flat(10+i) for i in range(7)])
+    monday=datetime(2026,10,19,12)
+    for i in range(7):
+        day=monday.replace(day=19+i)
+        assert day.weekday()==i
+        assert tp.timeToTemp(day)==10+i
+
+
+def test_weekends_are_saturday_and_sunday(store):
+    tp=loaded([flat(20)]*5+[flat(15)]*2)
+    assert tp.timeToTemp(datetime(2026,10,23,9))==20 # Friday
+    assert tp.timeToTemp(datetime(2026,10,24,9))==15 # Saturday
+    assert tp.timeToTemp(datetime(2026,10,25,9))==15 # Sunday
+    assert tp.timeToTemp(datetime(2026,10,26,9))==20 # Monday
+
+
+def test_load_migrates_weekdays_and_weekends(store):
+    main.settings.weekdays=flat(21)
+    main.settings.weekends=flat(18)
+    tp=TempProfiles()
+    tp.load()
+    assert tp.days==[flat(21)]*5+[flat(18)]*2
+    assert main.settings.get("dayprofiles")==tp.days
+    # Each day is its own copy
+    tp.setSlider("monday","0","25")
+    assert tp.days[1][0][1]==21
+
+
+def test_unknown_timezone_falls_back_to_default(store):
+    main.settings.timezone="Europe/Londn"
+    tp=TempProfiles()
+    tp.load()
+    assert tp.tztable.zonename==main.DEFAULT_TIMEZONE
+
+
+def test_edit_on_one_instance_seen_by_another(store):
+    first=loaded([flat(20)]*7)
+    second=TempProfiles()
+    second.load()
+    first.setSlider("tuesday","12","23")
+    second._checked-=main.VERSION_CHECK_SECONDS
+    second.sync()
+    assert second.version==first.version
+    assert second.days[1]==[[0,20],[12,23.0]]
+    assert second.timeToTemp(datetime(2026,10,20,12))==23
+
+
+def test_sync_checks_at_most_once_a_second(store,monkeypatch):
+    first=loaded([flat(20)]*7)
+    second=TempProfiles()
+    second.load()
+    first.setSlider("tuesday","12","23")
+    peeks=[]
+    peek=settings.Settings.peek
+    # Patched on the class, as setting attributes on a Settings instance writes settings
+    monkeypatch.setattr(settings.Settings,"peek",lambda self,keyname:peeks.append(keyname) or peek(self,keyname))
+    second.sync()
+    assert peeks==[]
+    assert second.days[1]==flat(20)
+
+
+def test_sync_saves_profiles_back_if_setting_deleted(store):
+    tp=loaded([flat(20)]*7)
+    store.remove([entity for entity in store if entity.keyname=="dayprofiles"][0])
+    settings.memcache.delete(settings.MEMCACHE_PREFIX+"dayprofiles")
+    main.settings.setone("profiles_version",1)
+    tp._checked-=main.VERSION_CHECK_SECONDS
+    tp.sync()
+    assert tp.days==[flat(20)]*7
+    assert main.settings.peek("dayprofiles")==[flat(20)]*7
+    assert main.settings.peek("profiles_version")==tp.version!=1
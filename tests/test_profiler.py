@@ -0,0 +1,29 @@
+import profiler
+from profiler import ProfilerMiddleware
+
+
+def app(environ,start_response):
+    return ["done"]
+
+
+def test_header_from_non_admin_falls_through_to_sampling(monkeypatch):
+    monkeypatch.setattr(profiler.users,"is_current_user_admin",lambda:False)
+    environ={profiler.HEADER_KEY:"1"}
+    assert ProfilerMiddleware(app,sample_rate=1).wanted(environ)
+    assert not ProfilerMiddleware(app,sample_rate=0).wanted(environ)
+
+
+def test_header_from_admin_is_profiled(monkeypatch):
+    monkeypatch.setattr(profiler.users,"is_current_user_admin",lambda:True)
+    assert ProfilerMiddleware(app,sample_rate=0).wanted({profiler.HEADER_KEY:"1"})
+
+
+def test_profiled_requests_are_aggregated():
+    profiler.aggregate.reset()
+    middleware=ProfilerMiddleware(app,sample_rate=1)
+    assert middleware({"PATH_INFO":"/"},None)==["done"]
+    assert middleware({"PATH_INFO":"/"},None)==["done"]
+    assert profiler.aggregate.requests["/"]==2
+    for sort in ("cumulative","tottime"):
+        assert sort in profiler.SORT_KEYS
+        assert "app" in profiler.aggregate.topCallSites(sort=sort)
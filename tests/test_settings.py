@@ -0,0 +1,124 @@
+import pytest
+
+import settings
+from settings import CODECS,SettingStore,Settings,codecFor
+
+
+@pytest.fixture
+def store():
+    del SettingStore._store[:]
+    settings.memcache.flush_all()
+    return SettingStore._store
+
+
+def addEntity(keyname,enttype,value):
+    entity=SettingStore()
+    entity.keyname=keyname
+    entity.enttype=enttype
+    entity.value=value
+    entity.put()
+    return entity
+
+
+@pytest.mark.parametrize("enttype,value",[
+    ("int",42),
+    ("float",19.5),
+    ("boolean",True),
+    ("boolean",False),
+    ("string","hello"),
+    ("json",{"monday":[[0,17],[6.5,21.0]]}),
+])
+def test_codec_round_trip(enttype,value):
+    codec=CODECS[enttype]
+    assert codec.decode(codec.encode(value))==value
+
+
+def test_boolean_decodes_stored_text():
+    assert CODECS["boolean"].decode("True") is True
+    assert CODECS["boolean"].decode("False") is False
+
+
+def test_string_encodes_non_strings_as_text():
+    assert CODECS["string"].encode(19.5)=="19.5"
+
+
+def test_missing_enttype_is_string():
+    assert codecFor(None) is CODECS["string"]
+    assert codecFor(None).decode('{"a":1}')=='{"a":1}'
+
+
+def test_unknown_enttype_is_json():
+    assert codecFor("mystery") is CODECS["json"]
+
+
+def test_get_decodes_once_until_text_changes(store,monkeypatch):
+    entity=addEntity("profile","json","[1, 2]")
+    s=Settings(maxage=1000)
+    calls=[]
+    decode=CODECS["json"].decode
+    monkeypatch.setitem(CODECS,"json",CODECS["json"]._replace(decode=lambda text:calls.append(text) or decode(text)))
+
+    first=s.get("profile")
+    s.forcerefresh()
+    assert s.get("profile") is first
+    assert calls==["[1, 2]"]
+
+    entity.value="[3]"
+    s.forcerefresh()
+    assert s.get("profile")==[3]
+    assert calls==["[1, 2]","[3]"]
+
+
+def test_forcerefresh_drops_memos_for_deleted_keys(store):
+    entity=addEntity("gone","int","7")
+    s=Settings(maxage=1000)
+    assert s.get("gone")==7
+    entity.key.delete()
+    s.forcerefresh()
+    assert "gone" not in s._decoded
+    assert s.get("gone") is None
+
+
+def test_setone_does_not_share_callers_object(store):
+    s=Settings(maxage=1000)
+    days=[[0,17]]
+    s.setone("days",days)
+    days[0][1]=30
+    assert s.get("days")==[[0,17]]
+
+
+def test_setone_stores_text_for_existing_string(store):
+    entity=addEntity("actual_temp","string","18")
+    s=Settings(maxage=1000)
+    s.setone("actual_temp",19.5)
+    assert entity.value=="19.5"
+    assert s.get("actual_temp")=="19.5"
+
+
+def test_peek_reads_memcache_over_the_local_cache(store):
+    addEntity("profiles_version","int","1")
+    s=Settings(maxage=1000)
+    other=Settings(maxage=1000)
+    other.setone("profiles_version",2)
+    assert s.get("profiles_version")==1
+    assert s.peek("profiles_version")==2
+
+
+def test_peek_falls_back_to_the_datastore_and_fills_memcache(store):
+    addEntity("profiles_version","int","3")
+    s=Settings(maxage=1000)
+    settings.memcache.flush_all()
+    assert s.peek("profiles_version")==3
+    assert settings.memcache.get(settings.MEMCACHE_PREFIX+"profiles_version")==("int","3")
+
+
+def test_peek_fill_does_not_overwrite_a_newer_write(store):
+    stale=addEntity("profiles_version","int","3")
+    Settings(maxage=1000).setone("profiles_version",4)
+    settings.fillCache(stale)
+    assert settings.memcache.get(settings.MEMCACHE_PREFIX+"profiles_version")==("int","4")
+
+
+def test_peek_missing_setting(store):
+    s=Settings(maxage=1000)
+    assert s.peek("nothing") is None
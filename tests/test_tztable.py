@@ -0,0 +1,61 @@
+from datetime import datetime,timedelta
+
+import pytest
+
+pytest.importorskip("pytz")
+
+from tztable import TzTable,EPOCH,toEpoch
+
+SPRING=datetime(2026,3,29,1) # UTC, clocks go forward to BST
+AUTUMN=datetime(2026,10,25,1) # UTC, clocks go back to GMT
+
+
+@pytest.fixture(scope="module")
+def london():
+    return TzTable("Europe/London",years=2,startyear=2026)
+
+
+def test_transitions_found_to_the_second(london):
+    starts,offsets=london.transitions()
+    assert starts[:3]==[toEpoch(datetime(2026,1,1)),toEpoch(SPRING),toEpoch(AUTUMN)]
+    assert offsets[:3]==[0,3600,0]
+    assert len(starts)==5 # Two changes a year for two years
+
+
+@pytest.mark.parametrize("utcdt,offset",[
+    (SPRING-timedelta(seconds=1),0),
+    (SPRING,3600),
+    (AUTUMN-timedelta(seconds=1),3600),
+    (AUTUMN,0),
+])
+def test_offset_either_side_of_changes(london,utcdt,offset):
+    assert london.offsetAt(utcdt)==offset
+
+
+def test_to_local_across_changes(london):
+    assert london.toLocal(SPRING-timedelta(minutes=1))==datetime(2026,3,29,0,59)
+    assert london.toLocal(SPRING)==datetime(2026,3,29,2,0)
+    assert london.toLocal(AUTUMN-timedelta(minutes=1))==datetime(2026,10,25,1,59)
+    assert london.toLocal(AUTUMN)==datetime(2026,10,25,1,0)
+
+
+def test_extend_keeps_what_was_covered():
+    table=TzTable("Europe/London",years=1,startyear=2026)
+    table.extend(2024,2024)
+    assert table.covers(toEpoch(datetime(2024,6,1)))
+    assert table.covers(toEpoch(datetime(2026,12,31)))
+    assert table.offsetAt(datetime(2024,6,1))==3600
+
+
+def test_lookup_outside_rebuilds():
+    table=TzTable("Europe/London",years=1,startyear=2026)
+    assert not table.covers(toEpoch(datetime(2030,7,1)))
+    assert table.toLocal(datetime(2030,7,1,12))==datetime(2030,7,1,13)
+    assert table.covers(toEpoch(datetime(2030,7,1)))
+
+
+def test_southern_hemisphere_zone():
+    saopaulo=TzTable("America/Sao_Paulo",years=1,startyear=2018)
+    # Summer time ended at local midnight on 18th February 2018
+    assert saopaulo.offsetAt(datetime(2018,2,18,1,59))==-2*3600
+    assert saopaulo.offsetAt(datetime(2018,2,18,2,0))==-3*3600
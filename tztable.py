@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+"""
+
+        Precomputed Timezone Table
+        ==========================
+
+        App Engine instances run on UTC, so the heating schedule needs a local
+        clock. Rather than asking the tz database on every lookup, the UTC
+        offsets and daylight saving transitions for a zone are worked out once,
+        for a span of coming years, and kept as two parallel lists.
+
+        A lookup is then a search of the (short) transition list, an index
+        read and an offset add.
+
+
+        usage:
+                from tztable import TzTable
+
+                table=TzTable("Europe/London")  # Builds transitions for this year and the next few
+
+                table.localNow()                # Naive local datetime for right now
+
+                table.toLocal(utcdt)            # Naive local datetime for a naive UTC datetime
+
+                table.offsetAt(utcdt)           # UTC offset in seconds in force at utcdt
+
+                table.transitions()             # The raw table, for converting many times at once
+
+                table.extend(2024,2026)         # Widens the table, if needed, to cover those years
+
+        If a lookup falls outside the years covered the table is rebuilt
+        starting from that year, so this only touches the tz database at load
+        time and roughly once every few years afterwards.
+
+"""
+
+import logging,bisect
+from datetime import datetime,timedelta
+
+import pytz
+
+EPOCH=datetime(1970,1,1)
+
+
+def toEpoch(utcdt):
+    """Seconds since the epoch for a naive UTC datetime"""
+    delta=utcdt-EPOCH
+    return delta.days*86400+delta.seconds
+
+
+class TzTable(object):
+    """
+        UTC offsets and DST transitions for one zone over a run of years
+    """
+    def __init__(self,zonename,years=5,startyear=None):
+        self.zonename=zonename
+        self.years=years
+        self._tz=pytz.timezone(zonename)
+        if startyear==None:
+            startyear=datetime.utcnow().year
+        self.build(startyear)
+
+    def _tzoffset(self,utcdt):
+        # The only place the tz database is consulted
+        offset=pytz.utc.localize(utcdt).astimezone(self._tz).utcoffset()
+        return offset.days*86400+offset.seconds
+
+    def build(self,startyear):
+        """
+            Works out every change of UTC offset between the start of startyear
+            and the end of the covered span, to the nearest second
+        """
+        logging.info("Building timezone table for %s from %s for %s years" % (self.zonename,startyear,self.years))
+        start=datetime(startyear,1,1)
+        end=datetime(startyear+self.years,1,1)
+        first=toEpoch(start)
+        last=toEpoch(end)
+
+        starts=[first]
+        offsets=[self._tzoffset(start)]
+        day=start
+        while day<end:
+            nextday=day+timedelta(days=1)
+            nextoffset=self._tzoffset(nextday)
+            if nextoffset!=offsets[-1]:
+                # Narrow down to the second the offset changed
+                lo,hi=toEpoch(day),toEpoch(nextday)
+                while hi-lo>1:
+                    mid=(lo+hi)//2
+                    if self._tzoffset(EPOCH+timedelta(seconds=mid))==offsets[-1]:
+                        lo=mid
+                    else:
+                        hi=mid
+                starts.append(hi)
+                offsets.append(nextoffset)
+            day=nextday
+        # Swapped in as one tuple so concurrent lookups never mix an old table with new bounds
+        self._table=(first,last,starts,offsets)
+        logging.info("Timezone table for %s has %s transitions" % (self.zonename,len(starts)-1))
+
+    def extend(self,firstyear,lastyear):
+        """
+            Makes sure the table covers the years firstyear to lastyear inclusive,
+            rebuilding it over those and the years it already covered if not
+        """
+        first,last,starts,offsets=self._table
+        coveredfirst=(EPOCH+timedelta(seconds=first)).year
+        coveredend=(EPOCH+timedelta(seconds=last)).year # First year not covered
+        if coveredfirst<=firstyear and lastyear<coveredend:
+            return
+        startyear=min(firstyear,coveredfirst)
+        self.years=max(lastyear+1,coveredend)-startyear
+        self.build(startyear)
+
+    def covers(self,epoch):
+        first,last,starts,offsets=self._table
+        return first<=epoch<last
+
+    def transitions(self):
+        """
+            Returns the lists of transition times (epoch seconds, UTC) and the offsets
+            that start at them, for lookups in bulk
+        """
+        first,last,starts,offsets=self._table
+        return starts,offsets
+
+    def offsetAt(self,utcdt):
+        """
+            Returns the UTC offset in seconds in force at the naive UTC datetime
+        """
+        epoch=toEpoch(utcdt)
+        first,last,starts,offsets=self._table
+        if not first<=epoch<last:
+            self.build(utcdt.year)
+            first,last,starts,offsets=self._table
+        return offsets[bisect.bisect_right(starts,epoch)-1]
+
+    def toLocal(self,utcdt):
+        """
+            Converts a naive UTC datetime to a naive local datetime
+        """
+        return utcdt+timedelta(seconds=self.offsetAt(utcdt))
+
+    def localNow(self):
+        return self.toLocal(datetime.utcnow())